@@ -24,9 +24,26 @@ def create_app(test_config=None):
     # DATABASE is the path where the SQLite database file will be saved.
     # It’s under app.instance_path, which is the path that Flask has chosen for
     # the instance folder.
+    # PURGE_AFTER_DAYS and PURGE_BATCH_SIZE control how soft deleted posts
+    # are purged, and MAINTENANCE_INTERVAL (in seconds) turns on the
+    # in-process maintenance thread. See flaskr/maintenance.py.
+    # BACKUP_DIR and BACKUP_KEEP are the defaults for 'flask db backup'.
+    # The PROFILE_* keys configure the request profiler, see flaskr/profile.py.
     app.config.from_mapping(
         SECRET_KEY='dev',
-        DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite')
+        DATABASE=os.path.join(app.instance_path, 'flaskr.sqlite'),
+        PURGE_AFTER_DAYS=7,
+        PURGE_BATCH_SIZE=500,
+        MAINTENANCE_INTERVAL=None,
+        BACKUP_DIR=os.path.join(app.instance_path, 'backups'),
+        BACKUP_KEEP=7,
+        PROFILE=False,
+        PROFILE_SAMPLE_RATE=0.01,
+        PROFILE_INTERVAL=0.005,
+        PROFILE_DIR=os.path.join(app.instance_path, 'profiles'),
+        PROFILE_KEEP_DAYS=7,
+        PROFILE_HEADER='X-Flaskr-Profile',
+        PROFILE_TOKEN_MAX_AGE=3600,
     )
 
     if test_config is None:
@@ -51,8 +68,12 @@ def create_app(test_config=None):
         return 'Hello, World!'
 
     # register app with the database
-    from . import db
+    from . import db, maintenance, profile, render
     db.init_app(app)
+    maintenance.init_app(app)
+    render.init_app(app)
+    # must come before the blueprints, see profile.init_app
+    profile.init_app(app)
 
     # import and register blueprints
     from . import auth, blog
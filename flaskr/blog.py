@@ -5,6 +5,7 @@ from werkzeug.exceptions import abort
 
 from flaskr.auth import login_required
 from flaskr.db import get_db
+from flaskr.render import render_body
 
 # The blog should list all posts, allow logged in users to create posts,
 # and allow the author of a post to edit or delete it.
@@ -18,8 +19,9 @@ def index():
     """Index view shows all posts, most recent first."""
     db = get_db()
     posts = db.execute(
-        'SELECT p.id, title, body, created, author_id, username'
+        'SELECT p.id, title, body_html, created, author_id, username'
         ' FROM post p JOIN user u ON p.author_id = u.id'
+        ' WHERE p.deleted IS NULL'
         ' ORDER BY created DESC'
     ).fetchall()
     return render_template('blog/index.html', posts=posts)
@@ -30,7 +32,7 @@ def index():
 def create():
     if request.method == 'POST':
         title = request.form['title']
-        body = request.form['title']
+        body = request.form['body']
         error = None
 
         if not title:
@@ -41,9 +43,9 @@ def create():
         else:
             db = get_db()
             db.execute(
-                'INSERT INTO post (title, body, author_id)'
-                ' VALUES (?, ?, ?)',
-                (title, body, g.user['id'])
+                'INSERT INTO post (title, body, body_html, author_id)'
+                ' VALUES (?, ?, ?, ?)',
+                (title, body, render_body(body), g.user['id'])
             )
             db.commit()
             return redirect(url_for('blog.index'))
@@ -58,7 +60,7 @@ def get_post(id, check_author=True):
     post = get_db().execute(
         'SELECT p.id, title, body, created, author_id, username'
         ' FROM post p JOIN user u ON p.author_id = u.id'
-        ' WHERE p.id = ?',
+        ' WHERE p.id = ? AND p.deleted IS NULL',
         (id,)
     ).fetchone()
 
@@ -91,9 +93,9 @@ def update(id):
         else:
             db = get_db()
             db.execute(
-                'UPDATE post SET title = ?, body = ?'
+                'UPDATE post SET title = ?, body = ?, body_html = ?'
                 ' WHERE id = ?',
-                (title, body, id)
+                (title, body, render_body(body), id)
             )
             db.commit()
             return redirect(url_for('blog.index'))
@@ -101,11 +103,16 @@ def update(id):
     return render_template('blog/update.html', post=post)
 
 
+# Deleting only marks the post. The row (and the space it takes up) is
+# reclaimed later by the maintenance job in 'flaskr.maintenance', so the
+# request never has to wait on a large delete or a vacuum.
 @bp.route('/<int:id>/delete', methods=['POST'])
 @login_required
 def delete(id):
     get_post(id)
     db = get_db()
-    db.execute('DELETE FROM post WHERE id = ?', (id,))
+    db.execute(
+        'UPDATE post SET deleted = CURRENT_TIMESTAMP WHERE id = ?', (id,)
+    )
     db.commit()
     return redirect(url_for('blog.index'))
@@ -1,4 +1,11 @@
+import gzip
+import hashlib
+import os
+import re
+import shutil
 import sqlite3
+import tempfile
+from datetime import datetime, timezone
 
 import click
 from flask import current_app, g
@@ -76,6 +83,61 @@ def init_db():
         db.executescript(f.read().decode('utf8'))
 
 
+# Columns added to tables since schema.sql was first deployed, as
+# (table, column, declaration). 'init-db' drops all data, so existing
+# databases are brought up to date with 'flask db upgrade' instead.
+UPGRADE_COLUMNS = [
+    ('post', 'deleted', 'TIMESTAMP'),
+    ('post', 'body_html', "TEXT NOT NULL DEFAULT ''"),
+]
+
+
+def upgrade_db():
+    """
+    Adds any of UPGRADE_COLUMNS missing from the database. Safe to run
+    more than once.
+
+    Returns: the list of 'table.column' names that were added
+    """
+    db = get_db()
+    added = []
+
+    # WAL lets 'flask db backup' read a snapshot while requests keep writing.
+    # The mode is stored in the database file, so this only has to run once.
+    db.execute('PRAGMA journal_mode = WAL')
+
+    for table, column, declaration in UPGRADE_COLUMNS:
+        columns = [
+            row['name'] for row in db.execute(f'PRAGMA table_info({table})')
+        ]
+        # no columns means no table: 'init-db' hasn't been run yet.
+        if columns and column not in columns:
+            db.execute(
+                f'ALTER TABLE {table} ADD COLUMN {column} {declaration}'
+            )
+            added.append(f'{table}.{column}')
+
+    if db.execute('PRAGMA table_info(post)').fetchone() is not None:
+        db.execute(
+            'CREATE INDEX IF NOT EXISTS post_deleted'
+            ' ON post (deleted) WHERE deleted IS NOT NULL'
+        )
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS maintenance_lease ('
+            ' id INTEGER PRIMARY KEY CHECK (id = 1),'
+            ' holder TEXT NOT NULL,'
+            ' expires TIMESTAMP NOT NULL)'
+        )
+    db.commit()
+
+    if 'post.body_html' in added:
+        # imported here because flaskr.render imports this module.
+        from flaskr.render import render_all_posts
+        render_all_posts()
+
+    return added
+
+
 # 'click.command()' defines a command line command called init-db
 # that calls the init_db function and shows a success message to the user.
 @click.command('init-db')
@@ -88,6 +150,212 @@ def init_db_command():
     click.echo('Initialized the database.')
 
 
+# ################ #
+# BACKUP NOTES:    #
+# ################ #
+# Copying the database file while the app is writing to it either blocks the
+# writers for the whole copy or produces a torn copy. 'Connection.backup()'
+# uses SQLite's online backup API instead, and copies the whole database in
+# one step ('pages=-1'), so it never restarts because of a write that lands
+# between steps.
+#
+# The database runs in WAL mode (see schema.sql and 'upgrade_db'). The backup
+# reads from a snapshot, and writers keep appending to the WAL file while it
+# runs, so live requests aren't blocked.
+
+
+def _checksum(path):
+    """Returns: the hex sha256 digest of the file at 'path'."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _integrity_check(path):
+    """
+    Raises ValueError unless the file at 'path' is an intact SQLite database.
+    """
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f'{path} is not a valid database: {e}')
+
+    if result != 'ok':
+        raise ValueError(f'{path} failed integrity check: {result}')
+
+
+def _list_backups(backup_dir):
+    """Returns: paths of the backups in 'backup_dir', oldest first."""
+    if not os.path.isdir(backup_dir):
+        return []
+    names = sorted(
+        name for name in os.listdir(backup_dir)
+        if name.startswith('flaskr-')
+        and name.endswith(('.sqlite', '.sqlite.gz'))
+    )
+    return [os.path.join(backup_dir, name) for name in names]
+
+
+def backup_db(backup_dir=None, compress=False, keep=None):
+    """
+    Takes a consistent snapshot of the live database with the online backup
+    API, verifies it, optionally gzips it, writes a '.sha256' file next to it
+    and removes all but the newest 'keep' backups (0 keeps them all).
+
+    Returns: the path of the new backup
+    """
+    if backup_dir is None:
+        backup_dir = current_app.config['BACKUP_DIR']
+    if keep is None:
+        keep = current_app.config['BACKUP_KEEP']
+    if keep < 0:
+        raise ValueError('keep must not be negative.')
+    os.makedirs(backup_dir, exist_ok=True)
+
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S-%f')
+    path = os.path.join(backup_dir, f'flaskr-{stamp}.sqlite')
+
+    # Everything is written under a '.tmp' name first and only renamed once
+    # it has been checked, so a failed backup is never mistaken for a good
+    # one by rotation or restore.
+    snapshot = path + '.tmp'
+    if compress:
+        path += '.gz'
+    compressed = path + '.tmp'
+    try:
+        target = sqlite3.connect(snapshot)
+        try:
+            get_db().backup(target, pages=-1)
+        finally:
+            target.close()
+        _integrity_check(snapshot)
+
+        if compress:
+            with open(snapshot, 'rb') as src:
+                with gzip.open(compressed, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            os.replace(compressed, path)
+        else:
+            os.replace(snapshot, path)
+    finally:
+        for leftover in (snapshot, compressed):
+            if os.path.exists(leftover):
+                os.unlink(leftover)
+
+    # same format as 'sha256sum', so 'sha256sum -c' can check it too.
+    with open(path + '.sha256', 'w') as f:
+        f.write(f'{_checksum(path)}  {os.path.basename(path)}\n')
+
+    if keep:
+        for old in _list_backups(backup_dir)[:-keep]:
+            os.unlink(old)
+            if os.path.exists(old + '.sha256'):
+                os.unlink(old + '.sha256')
+
+    return path
+
+
+def restore_db(path):
+    """
+    Replaces the contents of the live database with the backup at 'path',
+    after checking it against its '.sha256' file if there is one and making
+    sure it is an intact database.
+    """
+    if os.path.exists(path + '.sha256'):
+        with open(path + '.sha256') as f:
+            fields = f.read().split()
+        if not fields or not re.fullmatch(r'[0-9a-f]{64}', fields[0]):
+            raise ValueError(f'{path}.sha256 is not a valid checksum file.')
+        if _checksum(path) != fields[0]:
+            raise ValueError(f'Checksum mismatch for {path}.')
+
+    tmp_path = None
+    try:
+        if path.endswith('.gz'):
+            fd, tmp_path = tempfile.mkstemp(suffix='.sqlite')
+            with os.fdopen(fd, 'wb') as dst, gzip.open(path, 'rb') as src:
+                try:
+                    shutil.copyfileobj(src, dst)
+                except (OSError, EOFError) as e:
+                    raise ValueError(f'{path} is not a valid backup: {e}')
+            path = tmp_path
+
+        _integrity_check(path)
+
+        source = sqlite3.connect(path)
+        try:
+            # backing up *into* the live connection copies the snapshot over
+            # it as one consistent write.
+            source.backup(get_db(), pages=-1)
+        finally:
+            source.close()
+    finally:
+        if tmp_path is not None:
+            os.unlink(tmp_path)
+
+
+# 'click.group()' defines a 'db' command that the backup and restore
+# commands are attached to, so they are run as 'flask db backup' and
+# 'flask db restore'.
+@click.group('db')
+def db_cli():
+    """
+    Upgrade, back up and restore the database.
+    """
+
+
+@db_cli.command('upgrade')
+@with_appcontext
+def upgrade_command():
+    """
+    Add new columns to an existing database without losing data.
+    """
+    added = upgrade_db()
+    if added:
+        click.echo(f"Added {', '.join(added)}.")
+    else:
+        click.echo('The database is up to date.')
+
+
+@db_cli.command('backup')
+@click.option('--dir', 'backup_dir', type=click.Path(file_okay=False),
+              default=None, help='Directory to write the backup to.')
+@click.option('--compress', is_flag=True, help='Gzip the backup.')
+@click.option('--keep', type=click.IntRange(min=0), default=None,
+              help='Number of backups to keep, older ones are removed'
+                   ' (0 keeps them all).')
+@with_appcontext
+def backup_command(backup_dir, compress, keep):
+    """
+    Take an online snapshot of the database.
+    """
+    try:
+        path = backup_db(backup_dir, compress, keep)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Backed up the database to {path}.')
+
+
+@db_cli.command('restore')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@with_appcontext
+def restore_command(path):
+    """
+    Replace the database with a backup.
+    """
+    try:
+        restore_db(path)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Restored the database from {path}.')
+
+
 # The 'close_db()' and 'init_db_command()' functions need to be registered with
 # the application instance, or else they won't be used by the application.
 # HOWEVER, we are using a factory function to create the app (create_app()),
@@ -99,3 +367,4 @@ def init_app(app):
     app.teardown_appcontext(close_db)
     # add new command that can be called with the flask command
     app.cli.add_command(init_db_command)
+    app.cli.add_command(db_cli)
@@ -0,0 +1,245 @@
+# Background housekeeping for the database.
+#
+# Deleting a post from the blog only sets its 'deleted' timestamp (see
+# blog.delete). This module does the rest of the work outside the request:
+#
+#   1. purge soft deleted posts in small batches, committing after each one,
+#      so a large purge never holds the write lock for long,
+#   2. hand the free pages back to the filesystem with an incremental vacuum,
+#   3. let 'PRAGMA optimize' refresh the query planner statistics, which
+#      only re-analyzes the tables whose statistics are out of date.
+#
+# It can be run by hand with 'flask purge-posts', or every
+# MAINTENANCE_INTERVAL seconds by a daemon thread that the web process starts
+# on its first request. Every gunicorn worker starts one, so the threads take
+# turns through a lease row in the database and only the process holding the
+# lease does any work.
+
+import os
+import socket
+import threading
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from flaskr.db import get_db
+
+# Number of free pages released per incremental vacuum step.
+VACUUM_STEP = 1000
+
+
+def _db_size(db):
+    """
+    Returns: a tuple of (bytes used by the file, bytes sitting in free pages)
+    """
+    page_size = db.execute('PRAGMA page_size').fetchone()[0]
+    page_count = db.execute('PRAGMA page_count').fetchone()[0]
+    freelist_count = db.execute('PRAGMA freelist_count').fetchone()[0]
+    return page_count * page_size, freelist_count * page_size
+
+
+def purge_deleted_posts(older_than_days=None, batch_size=None):
+    """
+    Permanently removes posts that were soft deleted more than
+    'older_than_days' days ago, at most 'batch_size' rows per transaction.
+
+    Returns: the number of posts removed
+    """
+    if older_than_days is None:
+        older_than_days = current_app.config['PURGE_AFTER_DAYS']
+    if batch_size is None:
+        batch_size = current_app.config['PURGE_BATCH_SIZE']
+    # 'LIMIT 0' would never finish the loop below and 'LIMIT -1' has no limit.
+    if batch_size < 1:
+        raise ValueError('batch_size must be at least 1.')
+    # '--3 days' isn't a valid modifier, so the cutoff would be NULL and
+    # nothing would ever be purged.
+    if older_than_days < 0:
+        raise ValueError('older_than_days must not be negative.')
+
+    db = get_db()
+    cutoff = f'-{older_than_days} days'
+    purged = 0
+
+    while True:
+        cursor = db.execute(
+            'DELETE FROM post WHERE id IN ('
+            ' SELECT id FROM post'
+            " WHERE deleted IS NOT NULL AND deleted <= datetime('now', ?)"
+            ' LIMIT ?)',
+            (cutoff, batch_size)
+        )
+        db.commit()
+        purged += cursor.rowcount
+
+        if cursor.rowcount < batch_size:
+            return purged
+
+
+def vacuum_db():
+    """
+    Returns free pages to the filesystem.
+
+    Databases created before 'auto_vacuum' was added to schema.sql are
+    converted with a single full VACUUM; after that only the cheap
+    incremental vacuum is needed.
+    """
+    db = get_db()
+
+    if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        db.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        db.execute('VACUUM')
+    else:
+        # incremental_vacuum frees one page each time the statement is
+        # stepped, and 'execute' only steps it once, so run it through
+        # 'executescript' (which steps it to completion) a chunk at a time
+        # to keep each write lock short.
+        while db.execute('PRAGMA freelist_count').fetchone()[0]:
+            db.executescript(f'PRAGMA incremental_vacuum({VACUUM_STEP});')
+
+
+def optimize_db():
+    """
+    Refreshes the statistics the query planner uses to pick indexes.
+
+    A full 'ANALYZE' scans every index while holding the lock;
+    'PRAGMA optimize' only analyzes tables that need it.
+    """
+    db = get_db()
+    db.execute('PRAGMA optimize')
+    db.commit()
+
+
+def run_maintenance(older_than_days=None, batch_size=None):
+    """
+    Purges soft deleted posts, vacuums and optimizes the database.
+
+    Returns: a dict with the number of posts purged and the bytes reclaimed
+    """
+    db = get_db()
+    size_before, _ = _db_size(db)
+
+    purged = purge_deleted_posts(older_than_days, batch_size)
+    vacuum_db()
+    # measured before 'optimize_db', which can add pages of its own (the
+    # first run creates 'sqlite_stat1').
+    size_after, _ = _db_size(db)
+    optimize_db()
+
+    return {
+        'purged': purged,
+        'size_before': size_before,
+        'size_after': size_after,
+        'reclaimed': size_before - size_after,
+    }
+
+
+@click.command('purge-posts')
+@click.option('--older-than', 'older_than_days', type=click.IntRange(min=0),
+              default=None,
+              help='Only purge posts deleted at least this many days ago.')
+@click.option('--batch-size', type=click.IntRange(min=1), default=None,
+              help='Number of posts removed per transaction.')
+@with_appcontext
+def purge_posts_command(older_than_days, batch_size):
+    """
+    Purge soft deleted posts and compact the database.
+    """
+    stats = run_maintenance(older_than_days, batch_size)
+    click.echo(
+        f"Purged {stats['purged']} posts, reclaimed {stats['reclaimed']}"
+        f" bytes ({stats['size_before']} -> {stats['size_after']})."
+    )
+
+
+def acquire_lease(holder, duration):
+    """
+    Takes or renews the maintenance lease for 'duration' seconds, unless
+    another holder has a lease that hasn't expired yet.
+
+    Returns: True if 'holder' now holds the lease
+    """
+    db = get_db()
+
+    # 'BEGIN IMMEDIATE' takes the write lock before reading, so two processes
+    # can't both see an expired lease and take it.
+    db.execute('BEGIN IMMEDIATE')
+    try:
+        row = db.execute(
+            'SELECT holder FROM maintenance_lease'
+            ' WHERE id = 1 AND expires > CURRENT_TIMESTAMP'
+        ).fetchone()
+        if row is not None and row['holder'] != holder:
+            return False
+
+        db.execute(
+            'INSERT OR REPLACE INTO maintenance_lease (id, holder, expires)'
+            " VALUES (1, ?, datetime('now', ?))",
+            (holder, f'{duration:+} seconds')
+        )
+        return True
+    finally:
+        db.commit()
+
+
+def _maintenance_loop(app, interval, stop):
+    holder = f'{socket.gethostname()}:{os.getpid()}'
+
+    # 'stop.wait' returns True once the event is set, which ends the loop.
+    while not stop.wait(interval):
+        with app.app_context():
+            try:
+                # the lease outlives one interval, so the holder keeps it as
+                # long as it is alive and another process takes over if not.
+                if not acquire_lease(holder, 2 * interval):
+                    continue
+                stats = run_maintenance()
+            except Exception:
+                app.logger.exception('Database maintenance failed.')
+            else:
+                app.logger.info(
+                    'Database maintenance purged %d posts, reclaimed %d'
+                    ' bytes.', stats['purged'], stats['reclaimed']
+                )
+
+
+def start_scheduler(app):
+    """
+    Runs 'run_maintenance' every MAINTENANCE_INTERVAL seconds on a daemon
+    thread.
+
+    Returns: a threading.Event that stops the thread when set
+    """
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=_maintenance_loop,
+        args=(app, app.config['MAINTENANCE_INTERVAL'], stop),
+        name='flaskr-maintenance',
+        daemon=True,
+    )
+    thread.start()
+    return stop
+
+
+_scheduler_lock = threading.Lock()
+
+
+def _start_scheduler_once():
+    app = current_app._get_current_object()
+
+    if 'flaskr_maintenance' not in app.extensions:
+        with _scheduler_lock:
+            if 'flaskr_maintenance' not in app.extensions:
+                app.extensions['flaskr_maintenance'] = start_scheduler(app)
+
+
+def init_app(app):
+    app.cli.add_command(purge_posts_command)
+
+    # The scheduler is opt-in: most deployments run 'flask purge-posts'
+    # from cron instead. It is started on the first request rather than
+    # here, so 'flask' commands (which also call create_app) never start it
+    # and each gunicorn worker starts it after it has been forked.
+    if app.config['MAINTENANCE_INTERVAL']:
+        app.before_request(_start_scheduler_once)
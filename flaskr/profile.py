@@ -0,0 +1,288 @@
+# Opt-in sampling profiler for requests.
+#
+# While a profiled request runs, a helper thread looks at the request thread's
+# stack every PROFILE_INTERVAL seconds and counts how often each stack is
+# seen. This covers everything the request does: 'load_logged_in_user', the
+# view, 'render_template' and the teardown functions. The counts are
+# appended to '<PROFILE_DIR>/<YYYY-MM-DD>/<endpoint>.folded' in the
+# "collapsed stack" format ('outer;inner;leaf count' per line) that
+# flamegraph.pl and speedscope read to draw flame graphs. A new directory is
+# started every day (UTC), and days older than PROFILE_KEEP_DAYS are removed
+# then, so the profiles can't fill the disk. 'flask profile clear' removes
+# them by hand.
+#
+# A request is profiled when:
+#   - PROFILE is True, for a random PROFILE_SAMPLE_RATE share of requests, or
+#   - it carries a PROFILE_HEADER header holding a token from
+#     'flask profile token'. The token is signed with SECRET_KEY, so nobody
+#     else can turn profiling on, and it expires after PROFILE_TOKEN_MAX_AGE
+#     seconds.
+#
+# 'flask profile report' sums the samples up per endpoint and shows where
+# the time goes.
+
+import os
+import random
+import re
+import shutil
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app, g, request
+from flask.cli import with_appcontext
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+
+def _serializer():
+    return URLSafeTimedSerializer(
+        current_app.config['SECRET_KEY'], salt='flaskr-profile'
+    )
+
+
+def make_token():
+    """Returns: a signed token that turns profiling on for a request."""
+    return _serializer().dumps('profile')
+
+
+def _should_profile():
+    token = request.headers.get(current_app.config['PROFILE_HEADER'])
+
+    if token is not None:
+        try:
+            _serializer().loads(
+                token, max_age=current_app.config['PROFILE_TOKEN_MAX_AGE']
+            )
+        except BadSignature:
+            # covers expired tokens too (SignatureExpired is a subclass).
+            pass
+        else:
+            return True
+
+    return (current_app.config['PROFILE']
+            and random.random() < current_app.config['PROFILE_SAMPLE_RATE'])
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}:{code.co_name}"
+
+
+class Sampler(object):
+    """Samples the stack of one thread until 'stop' is called."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name='flaskr-profiler', daemon=True
+        )
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+
+_DAY_RE = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+def _day(days_ago=0):
+    date = datetime.now(timezone.utc) - timedelta(days=days_ago)
+    return date.strftime('%Y-%m-%d')
+
+
+def _day_dirs(profile_dir):
+    """Returns: the names of the per-day directories, oldest first."""
+    if not os.path.isdir(profile_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(profile_dir) if _DAY_RE.match(name)
+    )
+
+
+def clear_profiles(profile_dir, older_than_days=None):
+    """
+    Removes the profiles of days more than 'older_than_days' days ago, or all
+    of them if it is None.
+
+    Returns: the number of days removed
+    """
+    days = _day_dirs(profile_dir)
+    if older_than_days is not None:
+        # 'YYYY-MM-DD' names sort in date order.
+        cutoff = _day(older_than_days)
+        days = [day for day in days if day < cutoff]
+
+    for day in days:
+        shutil.rmtree(os.path.join(profile_dir, day), ignore_errors=True)
+    return len(days)
+
+
+def _profile_path(endpoint):
+    profile_dir = current_app.config['PROFILE_DIR']
+    day_dir = os.path.join(profile_dir, _day())
+
+    # the first profile of a new day rotates out the old days.
+    if not os.path.isdir(day_dir):
+        os.makedirs(day_dir, exist_ok=True)
+        clear_profiles(profile_dir, current_app.config['PROFILE_KEEP_DAYS'])
+
+    # endpoints look like 'blog.index'; keep the file name safe anyway.
+    name = re.sub(r'[^\w.-]', '_', endpoint or 'unknown')
+    return os.path.join(day_dir, f'{name}.folded')
+
+
+def start_profiling():
+    if _should_profile():
+        g.profiler = Sampler(
+            threading.get_ident(), current_app.config['PROFILE_INTERVAL']
+        )
+        g.profiler.start()
+
+
+def stop_profiling(e=None):
+    sampler = g.pop('profiler', None)
+
+    if sampler is None:
+        return
+
+    stacks = sampler.stop()
+    if not stacks:
+        return
+
+    # Each request appends its own lines, so several worker processes can
+    # share the directory; 'read_profiles' adds duplicate stacks up again.
+    lines = ''.join(f'{stack} {count}\n' for stack, count in stacks.items())
+    with open(_profile_path(request.endpoint), 'a') as f:
+        f.write(lines)
+
+
+def read_profiles(profile_dir, days=None):
+    """
+    Reads the profiles of the last 'days' days (today included), or of all
+    the days kept if it is None.
+
+    Returns: a dict of endpoint -> Counter of collapsed stack -> samples
+    """
+    profiles = {}
+    day_dirs = _day_dirs(profile_dir)
+    if days is not None:
+        cutoff = _day(days - 1)
+        day_dirs = [day for day in day_dirs if day >= cutoff]
+
+    for day in day_dirs:
+        day_dir = os.path.join(profile_dir, day)
+        for name in sorted(os.listdir(day_dir)):
+            if not name.endswith('.folded'):
+                continue
+            stacks = profiles.setdefault(name[:-len('.folded')], Counter())
+            with open(os.path.join(day_dir, name)) as f:
+                for line in f:
+                    stack, _, count = line.rstrip('\n').rpartition(' ')
+                    # skip lines that don't parse (e.g. a write cut short)
+                    # rather than losing the whole report to one of them.
+                    if stack and count.isdigit():
+                        stacks[stack] += int(count)
+
+    return profiles
+
+
+@click.group('profile')
+def profile_cli():
+    """
+    Profile requests and report on the results.
+    """
+
+
+@profile_cli.command('token')
+@with_appcontext
+def token_command():
+    """
+    Print a token that profiles any request sent with it.
+    """
+    click.echo(f"{current_app.config['PROFILE_HEADER']}: {make_token()}")
+
+
+@profile_cli.command('report')
+@click.option('--endpoint', default=None, help='Only report this endpoint.')
+@click.option('--limit', type=click.IntRange(min=1), default=10,
+              help='Number of functions shown per endpoint.')
+@click.option('--days', type=click.IntRange(min=1), default=None,
+              help='Only report the last this many days.')
+@click.option('--collapsed', is_flag=True,
+              help='Print the merged collapsed stacks for a flame graph.')
+@with_appcontext
+def report_command(endpoint, limit, days, collapsed):
+    """
+    Show where profiled requests spent their time.
+    """
+    profiles = read_profiles(current_app.config['PROFILE_DIR'], days)
+    if endpoint is not None:
+        profiles = {endpoint: profiles.get(endpoint, Counter())}
+
+    if not any(profiles.values()):
+        click.echo('No profiles recorded.')
+        return
+
+    for name, stacks in profiles.items():
+        if collapsed:
+            for stack, count in stacks.most_common():
+                click.echo(f'{stack} {count}')
+            continue
+
+        total = sum(stacks.values())
+        own = Counter()
+        cumulative = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            # a recursive function only counts once per stack.
+            for frame in set(frames):
+                cumulative[frame] += count
+
+        click.echo(f'{name}: {total} samples')
+        click.echo(f"  {'own':>6} {'total':>6}  function")
+        for frame, count in own.most_common(limit):
+            click.echo(
+                f'  {count / total:6.1%} {cumulative[frame] / total:6.1%}'
+                f'  {frame}'
+            )
+
+
+@profile_cli.command('clear')
+@click.option('--older-than', 'older_than_days', type=click.IntRange(min=0),
+              default=None,
+              help='Only remove days more than this many days ago.')
+@with_appcontext
+def clear_command(older_than_days):
+    """
+    Remove recorded profiles.
+    """
+    count = clear_profiles(current_app.config['PROFILE_DIR'], older_than_days)
+    click.echo(f'Removed {count} day(s) of profiles.')
+
+
+def init_app(app):
+    # Registered before the blueprints so that 'start_profiling' runs ahead
+    # of 'auth.load_logged_in_user' and the profile covers it.
+    app.before_request(start_profiling)
+    app.teardown_request(stop_profiling)
+    app.cli.add_command(profile_cli)
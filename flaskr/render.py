@@ -0,0 +1,97 @@
+# Post bodies are written in Markdown.
+#
+# Rendering Markdown and then sanitizing the HTML is far more expensive than
+# reading a column, so it is done once when a post is created or updated and
+# the result is stored in 'post.body_html'. The index page just prints that
+# column.
+#
+# If 'render_body' changes (a new Markdown extension, a different list of
+# allowed tags...), the stored HTML is stale: run 'flask render-posts' to
+# re-render every post.
+
+from concurrent.futures import ProcessPoolExecutor
+
+import bleach
+import click
+import markdown
+from flask.cli import with_appcontext
+
+from flaskr.db import get_db
+
+# Markdown can contain raw HTML, so anything not on these lists is stripped
+# before the HTML is stored and later marked as safe in the template.
+ALLOWED_TAGS = set(bleach.sanitizer.ALLOWED_TAGS) | {
+    'p', 'pre', 'hr', 'br', 'img',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': ['href', 'title'],
+    'abbr': ['title'],
+    'acronym': ['title'],
+    'img': ['src', 'alt', 'title'],
+}
+
+# Number of posts sent to a worker process at a time by 'render-posts'.
+RENDER_CHUNK_SIZE = 200
+
+
+def render_body(body):
+    """
+    Returns: the sanitized HTML for the Markdown text 'body'
+    """
+    html = markdown.markdown(body, extensions=['fenced_code'])
+    return bleach.clean(
+        html, tags=ALLOWED_TAGS, attributes=ALLOWED_ATTRIBUTES, strip=True
+    )
+
+
+def _render_rows(rows):
+    # Runs in a worker process, so it only takes and returns plain tuples.
+    return [(render_body(body), id, body) for id, body in rows]
+
+
+def render_all_posts(workers=None):
+    """
+    Re-renders 'body_html' for every post that isn't deleted, spreading the
+    work over a pool of 'workers' processes (one per CPU by default).
+
+    Returns: the number of posts rendered
+    """
+    db = get_db()
+    rows = [
+        tuple(row) for row in
+        db.execute('SELECT id, body FROM post WHERE deleted IS NULL')
+    ]
+    chunks = [
+        rows[i:i + RENDER_CHUNK_SIZE]
+        for i in range(0, len(rows), RENDER_CHUNK_SIZE)
+    ]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for rendered in pool.map(_render_rows, chunks):
+            # A post edited since it was read already has the HTML for its
+            # new body (from blog.update), so only write if the body is the
+            # one that was rendered.
+            db.executemany(
+                'UPDATE post SET body_html = ? WHERE id = ? AND body = ?',
+                rendered
+            )
+            db.commit()
+
+    return len(rows)
+
+
+@click.command('render-posts')
+@click.option('--workers', type=click.IntRange(min=1), default=None,
+              help='Number of worker processes (default: one per CPU).')
+@with_appcontext
+def render_posts_command(workers):
+    """
+    Re-render the stored HTML of every post.
+    """
+    count = render_all_posts(workers)
+    click.echo(f'Rendered {count} posts.')
+
+
+def init_app(app):
+    app.cli.add_command(render_posts_command)
@@ -1,5 +1,13 @@
+-- auto_vacuum must be chosen before any table is created. INCREMENTAL lets
+-- the maintenance job hand free pages back to the filesystem in small steps
+-- with 'PRAGMA incremental_vacuum' instead of rewriting the whole file.
+PRAGMA auto_vacuum = INCREMENTAL;
+-- WAL lets readers, including 'flask db backup', work alongside a writer.
+PRAGMA journal_mode = WAL;
+
 DROP TABLE IF EXISTS user;
 DROP TABLE IF EXISTS post;
+DROP TABLE IF EXISTS maintenance_lease;
 
 CREATE TABLE user (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -13,5 +21,19 @@ CREATE TABLE post (
     created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     title TEXT NOT NULL,
     body TEXT NOT NULL,
+    -- 'body' rendered from Markdown and sanitized, see flaskr/render.py.
+    body_html TEXT NOT NULL DEFAULT '',
+    -- set when a post is soft deleted; the row is purged later in batches.
+    deleted TIMESTAMP,
     FOREIGN KEY (author_id) REFERENCES user (id)
 );
+
+CREATE INDEX post_deleted ON post (deleted) WHERE deleted IS NOT NULL;
+
+-- a single row naming the process allowed to run the maintenance job, see
+-- flaskr/maintenance.py.
+CREATE TABLE maintenance_lease (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    holder TEXT NOT NULL,
+    expires TIMESTAMP NOT NULL
+);
@@ -14,5 +14,7 @@ setup(
     zip_safe=False,
     install_requires=[
         'flask',
+        'markdown',
+        'bleach',
     ],
 )
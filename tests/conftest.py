@@ -1,9 +1,10 @@
 import os
-import tempfile
+import sqlite3
 
 import pytest
 from flaskr import create_app
 from flaskr.db import get_db, init_db
+from flaskr.render import render_body
 
 # Contains setup functions called fixtures that each test will use.
 #
@@ -21,31 +22,124 @@ from flaskr.db import get_db, init_db
 with open(os.path.join(os.path.dirname(__file__), 'data.sql'), 'rb') as f:
     _data_sql = f.read().decode('utf8')
 
+# Size of the database behind the 'large_app' fixture.
+LARGE_USERS = 100
+LARGE_POSTS = 10000
+
+
+# '--db-mode=fresh' runs 'init_db' and 'data.sql' again for every test, the
+# way the fixtures used to. The default, 'template', builds each database
+# once per session and copies it for every test, which is much faster.
+def pytest_addoption(parser):
+    parser.addoption(
+        '--db-mode', choices=('template', 'fresh'), default='template',
+        help='How the test database is set up for each test.'
+    )
+
+
+def _seed_test_data(db):
+    db.executescript(_data_sql)
+
+
+def _seed_large_data(db):
+    _seed_test_data(db)
+    # every user shares the 'test' user's password hash so they can log in.
+    password = db.execute(
+        "SELECT password FROM user WHERE username = 'test'"
+    ).fetchone()[0]
+    db.executemany(
+        'INSERT INTO user (username, password) VALUES (?, ?)',
+        [(f'user{i}', password) for i in range(LARGE_USERS)]
+    )
+    bodies = [f'post *{i}*\n\n' + 'lorem ipsum ' * 50 for i in range(10)]
+    html = [render_body(body) for body in bodies]
+    db.executemany(
+        'INSERT INTO post (title, body, body_html, author_id, created)'
+        " VALUES (?, ?, ?, ?, datetime('2022-01-01', ?))",
+        [
+            (f'post {i}', bodies[i % 10], html[i % 10],
+             i % LARGE_USERS + 3, f'+{i} minutes')
+            for i in range(LARGE_POSTS)
+        ]
+    )
+    db.commit()
+
+
+def _build_database(path, seed):
+    """Creates the schema in the database at 'path' and calls 'seed'."""
+    app = create_app({'TESTING': True, 'DATABASE': str(path)})
+
+    with app.app_context():
+        init_db()
+        seed(get_db())
 
-# The 'app' fixture will call the factory and pass 'test_config' to configure
-# the application & database for testing instead of using the local dev config.
-@pytest.fixture
-def app():
-    # Create and open a temporary file, returns file descriptor and path to it.
-    db_fd, db_path = tempfile.mkstemp()
 
-    # Overrides the database path to point to this temp file instead of the
-    # instance folder.
+def _build_template(tmp_path_factory, name, seed):
+    """
+    Builds a database once, then loads it into an in-memory connection
+    that every test's database is copied from.
+    """
+    # Each pytest-xdist worker gets its own basetemp, and the worker id
+    # keeps the file names apart when a shared basetemp is given.
+    worker = os.environ.get('PYTEST_XDIST_WORKER', 'main')
+    path = tmp_path_factory.mktemp('db') / f'{name}-{worker}.sqlite'
+    _build_database(path, seed)
+
+    template = sqlite3.connect(':memory:')
+    source = sqlite3.connect(path)
+    source.backup(template)
+    source.close()
+    return template
+
+
+@pytest.fixture(scope='session')
+def _template_db(tmp_path_factory):
+    template = _build_template(tmp_path_factory, 'template', _seed_test_data)
+    yield template
+    template.close()
+
+
+@pytest.fixture(scope='session')
+def _large_template_db(tmp_path_factory):
+    template = _build_template(tmp_path_factory, 'large', _seed_large_data)
+    yield template
+    template.close()
+
+
+def _make_app(request, tmp_path, template, seed):
+    db_path = tmp_path / 'flaskr.sqlite'
+
+    if request.config.getoption('--db-mode') == 'fresh':
+        _build_database(db_path, seed)
+    else:
+        # The backup API copies the template page by page, so the copy is
+        # exactly what 'init_db' and the seed data would have produced.
+        target = sqlite3.connect(db_path)
+        template.backup(target)
+        target.close()
+
+    # Overrides the database path to point to this test's own file instead
+    # of the instance folder. 'tmp_path' is unique to each test (and to each
+    # worker when the tests run in parallel) and is cleaned up by pytest.
     # 'TESTING" tells the app that it's in test mode.
-    app = create_app({
+    return create_app({
         'TESTING': True,
-        'DATABASE': db_path
+        'DATABASE': str(db_path)
     })
 
-    with app.app_context():
-        init_db()
-        get_db().executescript(_data_sql)
 
-    yield app
+# The 'app' fixture will call the factory and pass 'test_config' to configure
+# the application & database for testing instead of using the local dev config.
+@pytest.fixture
+def app(request, tmp_path, _template_db):
+    return _make_app(request, tmp_path, _template_db, _seed_test_data)
+
 
-    # After testing is over, temp file is closed and removed.
-    os.close(db_fd)
-    os.unlink(db_path)
+# Same as 'app', but with LARGE_USERS extra users and LARGE_POSTS posts on
+# top of the normal test data, for tests that check how things scale.
+@pytest.fixture
+def large_app(request, tmp_path, _large_template_db):
+    return _make_app(request, tmp_path, _large_template_db, _seed_large_data)
 
 
 # Tests will use the client to make requests to the application
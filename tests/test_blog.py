@@ -71,15 +71,36 @@ def test_create(client, auth, app):
         assert count == 2
 
 
+# The body is rendered from Markdown when the post is saved, and anything
+# unsafe is stripped from the stored HTML.
+def test_create_renders_markdown(client, auth, app):
+    auth.login()
+    client.post('/create', data={
+        'title': 'created',
+        'body': '*hello*<script>alert(1)</script>',
+    })
+
+    with app.app_context():
+        post = get_db().execute(
+            'SELECT body, body_html FROM post WHERE id = 2'
+        ).fetchone()
+        assert post['body'] == '*hello*<script>alert(1)</script>'
+        assert '<em>hello</em>' in post['body_html']
+        assert '<script>' not in post['body_html']
+
+    assert b'<em>hello</em>' in client.get('/').data
+
+
 def test_update(client, auth, app):
     auth.login()
     assert client.get('/1/update').status_code == 200
-    client.post('/1/update', data={'title': 'updated', 'body': ''})
+    client.post('/1/update', data={'title': 'updated', 'body': '# heading'})
 
     with app.app_context():
         db = get_db()
         post = db.execute('SELECT * FROM post WHERE id = 1').fetchone()
         assert post['title'] == 'updated'
+        assert post['body_html'] == '<h1>heading</h1>'
 
 
 @pytest.mark.parametrize('path', (
@@ -92,7 +113,7 @@ def test_create_update_validate(client, auth, path):
 
 
 # The delete view should redirect to the index URL,
-# and the post should no longer exist in the database.
+# and the post should be marked as deleted (it is purged later).
 def test_delete(client, auth, app):
     auth.login()
     response = client.post('/1/delete')
@@ -101,4 +122,13 @@ def test_delete(client, auth, app):
     with app.app_context():
         db = get_db()
         post = db.execute('SELECT * FROM post WHERE id = 1').fetchone()
-        assert post is None
+        assert post['deleted'] is not None
+
+
+# A soft deleted post is hidden everywhere, and can't be edited again.
+def test_deleted_post_hidden(client, auth):
+    auth.login()
+    client.post('/1/delete')
+
+    assert b'test title' not in client.get('/').data
+    assert client.get('/1/update').status_code == 404
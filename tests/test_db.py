@@ -1,7 +1,8 @@
+import os
 import sqlite3
 
 import pytest
-from flaskr.db import get_db
+from flaskr.db import backup_db, get_db, restore_db
 
 
 # Within an application context, 'get_db' should return the same connection
@@ -32,3 +33,135 @@ def test_init_db_command(runner, monkeypatch):
     result = runner.invoke(args=['init-db'])
     assert 'Initialized' in result.output
     assert Recorder.called
+
+
+# 'db upgrade' adds new columns to a database created by an older schema.sql,
+# keeps its data, and does nothing when run again.
+def test_upgrade_command(app, runner):
+    with app.app_context():
+        db = get_db()
+        db.executescript(
+            'DROP INDEX post_deleted;'
+            'ALTER TABLE post DROP COLUMN deleted;'
+            'ALTER TABLE post DROP COLUMN body_html;'
+            'DROP TABLE maintenance_lease;'
+        )
+
+    result = runner.invoke(args=['db', 'upgrade'])
+    assert 'post.deleted, post.body_html' in result.output
+
+    with app.app_context():
+        post = get_db().execute('SELECT * FROM post').fetchone()
+        assert post['title'] == 'test title'
+        assert post['deleted'] is None
+        # existing posts get their HTML rendered as part of the upgrade.
+        assert post['body_html'] == '<p>test\nbody</p>'
+        assert get_db().execute(
+            'SELECT * FROM maintenance_lease'
+        ).fetchall() == []
+
+    result = runner.invoke(args=['db', 'upgrade'])
+    assert 'up to date' in result.output
+
+
+# A backup is a verified, checksummed snapshot that can be restored over
+# the live database, and only the newest 'keep' backups are kept.
+@pytest.mark.parametrize('compress', (False, True))
+def test_backup_restore(app, tmp_path, compress):
+    backup_dir = tmp_path / 'backups'
+
+    with app.app_context():
+        paths = [backup_db(backup_dir, compress=compress, keep=2)
+                 for _ in range(3)]
+        assert sorted(os.listdir(backup_dir)) == sorted(
+            os.path.basename(p) + ext
+            for p in paths[1:] for ext in ('', '.sha256')
+        )
+
+        db = get_db()
+        db.execute('DELETE FROM post')
+        db.commit()
+
+        restore_db(paths[-1])
+        assert db.execute('SELECT COUNT(*) FROM post').fetchone()[0] == 1
+
+
+def test_restore_checksum_mismatch(app, tmp_path):
+    with app.app_context():
+        path = backup_db(tmp_path / 'backups')
+        with open(path, 'ab') as f:
+            f.write(b'torn')
+
+        with pytest.raises(ValueError, match='Checksum'):
+            restore_db(path)
+
+
+# An empty or truncated '.sha256' file is an error, not a crash.
+@pytest.mark.parametrize('contents', ('', '0123abc'))
+def test_restore_invalid_checksum_file(app, runner, tmp_path, contents):
+    with app.app_context():
+        path = backup_db(tmp_path / 'backups')
+    with open(path + '.sha256', 'w') as f:
+        f.write(contents)
+
+    with app.app_context():
+        with pytest.raises(ValueError, match='not a valid checksum file'):
+            restore_db(path)
+
+    result = runner.invoke(args=['db', 'restore', path])
+    assert result.exit_code == 1
+    assert 'not a valid checksum file' in result.output
+
+
+# A backup that fails its check leaves nothing behind for rotation or
+# restore to pick up.
+def test_backup_failed(app, tmp_path, monkeypatch):
+    def fake_integrity_check(path):
+        raise ValueError('failed integrity check')
+
+    monkeypatch.setattr('flaskr.db._integrity_check', fake_integrity_check)
+    with app.app_context():
+        with pytest.raises(ValueError):
+            backup_db(tmp_path / 'backups', compress=True)
+
+    assert os.listdir(tmp_path / 'backups') == []
+
+
+def test_backup_keep(app, tmp_path):
+    backup_dir = tmp_path / 'backups'
+
+    with app.app_context():
+        for _ in range(3):
+            backup_db(backup_dir, keep=0)
+        assert len(os.listdir(backup_dir)) == 6
+
+        with pytest.raises(ValueError):
+            backup_db(backup_dir, keep=-1)
+
+
+# Files that aren't databases are refused even without a '.sha256' file.
+@pytest.mark.parametrize('name', ('junk.sqlite', 'junk.sqlite.gz'))
+def test_restore_invalid(app, runner, tmp_path, name):
+    path = tmp_path / name
+    path.write_bytes(b'not a database' * 100)
+
+    with app.app_context():
+        with pytest.raises(ValueError, match='not a valid'):
+            restore_db(str(path))
+
+    result = runner.invoke(args=['db', 'restore', str(path)])
+    assert result.exit_code == 1
+    assert 'not a valid' in result.output
+
+
+def test_backup_restore_commands(runner, tmp_path):
+    backup_dir = tmp_path / 'backups'
+    result = runner.invoke(args=['db', 'backup', '--dir', str(backup_dir)])
+    assert 'Backed up' in result.output
+
+    name = min(os.listdir(backup_dir))
+    result = runner.invoke(args=['db', 'restore', str(backup_dir / name)])
+    assert 'Restored' in result.output
+
+    result = runner.invoke(args=['db', 'backup', '--keep', '-1'])
+    assert result.exit_code == 2
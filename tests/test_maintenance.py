@@ -0,0 +1,128 @@
+import pytest
+from flaskr import create_app
+from flaskr.db import get_db
+from flaskr.maintenance import (
+    acquire_lease, purge_deleted_posts, run_maintenance
+)
+
+
+def _soft_delete_all(app, ago='-30 days'):
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, body, author_id) VALUES (?, ?, 1)',
+            [(f'post {i}', 'x' * 2000) for i in range(50)]
+        )
+        db.execute("UPDATE post SET deleted = datetime('now', ?)", (ago,))
+        db.commit()
+
+
+# Posts deleted before the cutoff are removed in batches; newer ones stay
+# until they are old enough.
+def test_purge_deleted_posts(app):
+    _soft_delete_all(app)
+
+    with app.app_context():
+        db = get_db()
+        db.execute(
+            "UPDATE post SET deleted = CURRENT_TIMESTAMP WHERE id = 1"
+        )
+        db.commit()
+
+        assert purge_deleted_posts(older_than_days=7, batch_size=8) == 50
+        remaining = db.execute('SELECT id FROM post').fetchall()
+        assert [row['id'] for row in remaining] == [1]
+
+
+@pytest.mark.parametrize(('older_than_days', 'batch_size'), (
+    (0, 0),
+    (-3, 500),
+))
+def test_purge_validate(app, older_than_days, batch_size):
+    with app.app_context():
+        with pytest.raises(ValueError):
+            purge_deleted_posts(older_than_days, batch_size)
+
+
+@pytest.mark.parametrize('args', (
+    ('--batch-size', '0'),
+    ('--older-than', '-3'),
+))
+def test_purge_posts_command_validate(runner, args):
+    result = runner.invoke(args=['purge-posts', *args])
+    assert result.exit_code == 2
+
+
+def test_run_maintenance_reclaims_space(app):
+    _soft_delete_all(app)
+
+    with app.app_context():
+        stats = run_maintenance(older_than_days=0)
+        db = get_db()
+
+        assert stats['purged'] == 51
+        assert stats['reclaimed'] > 0
+        assert db.execute('PRAGMA freelist_count').fetchone()[0] == 0
+
+
+# Nothing to purge must not be reported as negative space reclaimed, even
+# though the first 'PRAGMA optimize' adds a page for its statistics.
+def test_run_maintenance_nothing_to_purge(app):
+    with app.app_context():
+        stats = run_maintenance(older_than_days=0)
+
+        assert stats['purged'] == 0
+        assert stats['reclaimed'] >= 0
+
+
+def test_purge_posts_command(app, runner):
+    _soft_delete_all(app)
+    result = runner.invoke(args=['purge-posts', '--older-than', '0'])
+    assert 'Purged 51 posts' in result.output
+
+
+# Purging a large number of posts should still go through in small
+# transactions and leave the rest of the data untouched.
+def test_purge_large(large_app):
+    with large_app.app_context():
+        db = get_db()
+        db.execute(
+            "UPDATE post SET deleted = '2022-01-01' WHERE id % 2 = 0"
+        )
+        db.commit()
+
+        stats = run_maintenance(older_than_days=0, batch_size=500)
+        count = db.execute('SELECT COUNT(*) FROM post').fetchone()[0]
+
+        assert stats['purged'] == 5000
+        assert stats['reclaimed'] > 0
+        assert count == 5001
+
+
+# Only one process at a time may hold the lease; the holder can renew it.
+def test_acquire_lease(app):
+    with app.app_context():
+        assert acquire_lease('a', 60)
+        assert not acquire_lease('b', 60)
+        assert acquire_lease('a', 60)
+
+        # an expired lease can be taken over.
+        assert acquire_lease('a', -1)
+        assert acquire_lease('b', 60)
+
+
+# The scheduler must not start from create_app (which 'flask' commands call
+# too), only once the app serves its first request.
+def test_scheduler_starts_on_first_request(app):
+    app = create_app({
+        'TESTING': True,
+        'DATABASE': app.config['DATABASE'],
+        'MAINTENANCE_INTERVAL': 3600,
+    })
+    assert 'flaskr_maintenance' not in app.extensions
+
+    app.test_client().get('/hello')
+    stop = app.extensions['flaskr_maintenance']
+    app.test_client().get('/hello')
+    assert app.extensions['flaskr_maintenance'] is stop
+    stop.set()
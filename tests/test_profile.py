@@ -0,0 +1,118 @@
+import os
+import time
+
+import pytest
+from flaskr import create_app
+from flaskr.profile import make_token, read_profiles
+
+
+def slow_view():
+    time.sleep(0.05)
+    return 'done'
+
+
+@pytest.fixture
+def profile_app(app, tmp_path):
+    app.config.update(
+        PROFILE_DIR=str(tmp_path / 'profiles'),
+        PROFILE_INTERVAL=0.001,
+    )
+    app.add_url_rule('/slow', 'slow', slow_view)
+    return app
+
+
+# With PROFILE on and every request sampled, the stacks seen during the
+# request are written under its endpoint.
+def test_profile_config(profile_app):
+    profile_app.config.update(PROFILE=True, PROFILE_SAMPLE_RATE=1.0)
+    assert profile_app.test_client().get('/slow').data == b'done'
+
+    stacks = read_profiles(profile_app.config['PROFILE_DIR'])['slow']
+    assert any(stack.endswith('test_profile:slow_view')
+               for stack in stacks)
+
+
+# A signed header turns profiling on for one request, a forged one doesn't.
+@pytest.mark.parametrize(('valid', 'profiled'), (
+    (True, True),
+    (False, False),
+))
+def test_profile_header(profile_app, valid, profiled):
+    with profile_app.app_context():
+        token = make_token() if valid else 'forged'
+
+    profile_app.test_client().get('/slow', headers={
+        profile_app.config['PROFILE_HEADER']: token
+    })
+
+    profiles = read_profiles(profile_app.config['PROFILE_DIR'])
+    assert ('slow' in profiles) == profiled
+
+
+def test_profile_off_by_default(profile_app):
+    assert not create_app({'TESTING': True}).config['PROFILE']
+    profile_app.test_client().get('/slow')
+    assert read_profiles(profile_app.config['PROFILE_DIR']) == {}
+
+
+def test_profile_report_command(profile_app):
+    runner = profile_app.test_cli_runner()
+    assert 'No profiles' in runner.invoke(args=['profile', 'report']).output
+
+    profile_app.config.update(PROFILE=True, PROFILE_SAMPLE_RATE=1.0)
+    client = profile_app.test_client()
+    client.get('/slow')
+    client.get('/slow')
+
+    result = runner.invoke(args=['profile', 'report'])
+    assert 'slow:' in result.output
+    assert 'test_profile:slow_view' in result.output
+
+    result = runner.invoke(args=['profile', 'report', '--collapsed'])
+    assert 'test_profile:slow_view ' in result.output
+
+
+def test_read_profiles_skips_malformed_lines(tmp_path):
+    day_dir = tmp_path / '2000-01-01'
+    day_dir.mkdir()
+    (day_dir / 'slow.folded').write_text('a;b 2\na;b x\ngarbage\na;c 1\n')
+
+    assert read_profiles(str(tmp_path)) == {
+        'slow': {'a;b': 2, 'a;c': 1}
+    }
+
+
+def test_profile_report_command_validate(profile_app):
+    runner = profile_app.test_cli_runner()
+    result = runner.invoke(args=['profile', 'report', '--limit', '-1'])
+    assert result.exit_code == 2
+
+
+# Profiles go into one directory per day, and starting a new day removes
+# the days older than PROFILE_KEEP_DAYS.
+def test_profile_rotation(profile_app):
+    profile_dir = profile_app.config['PROFILE_DIR']
+    for day in ('2000-01-01', '2000-01-02'):
+        os.makedirs(os.path.join(profile_dir, day))
+        with open(os.path.join(profile_dir, day, 'slow.folded'), 'w') as f:
+            f.write('old;stack 5\n')
+
+    profile_app.config.update(PROFILE=True, PROFILE_SAMPLE_RATE=1.0)
+    profile_app.test_client().get('/slow')
+
+    days = os.listdir(profile_dir)
+    assert len(days) == 1 and not days[0].startswith('2000')
+    assert 'old;stack' not in read_profiles(profile_dir)['slow']
+
+
+def test_profile_clear_command(profile_app):
+    profile_app.config.update(PROFILE=True, PROFILE_SAMPLE_RATE=1.0)
+    profile_app.test_client().get('/slow')
+    runner = profile_app.test_cli_runner()
+
+    result = runner.invoke(args=['profile', 'clear', '--older-than', '1'])
+    assert 'Removed 0 day(s)' in result.output
+
+    result = runner.invoke(args=['profile', 'clear'])
+    assert 'Removed 1 day(s)' in result.output
+    assert read_profiles(profile_app.config['PROFILE_DIR']) == {}
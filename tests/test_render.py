@@ -0,0 +1,76 @@
+import sqlite3
+
+from flaskr.db import get_db
+from flaskr.render import render_all_posts, render_body
+
+
+def test_render_body():
+    assert render_body('**bold**') == '<p><strong>bold</strong></p>'
+    assert render_body('[x](javascript:alert(1))') == '<p><a>x</a></p>'
+
+
+# 'render-posts' should fill in 'body_html' for every post, e.g. after the
+# renderer has changed or for posts written before it existed.
+def test_render_posts_command(app, runner):
+    with app.app_context():
+        db = get_db()
+        db.executemany(
+            'INSERT INTO post (title, body, author_id) VALUES (?, ?, 1)',
+            [(f'post {i}', f'post *{i}*') for i in range(300)]
+        )
+        db.commit()
+
+        # soft deleted posts are left alone.
+        db.execute(
+            "INSERT INTO post (title, body, author_id, deleted)"
+            " VALUES ('deleted', '*deleted*', 1, CURRENT_TIMESTAMP)"
+        )
+        db.commit()
+
+    result = runner.invoke(args=['render-posts', '--workers', '2'])
+    assert 'Rendered 301 posts' in result.output
+
+    with app.app_context():
+        rows = get_db().execute(
+            'SELECT body_html FROM post WHERE id > 1 ORDER BY id'
+        ).fetchall()
+        assert [row['body_html'] for row in rows] == [
+            f'<p>post <em>{i}</em></p>' for i in range(300)
+        ] + ['']
+
+
+def test_render_posts_command_validate(runner):
+    result = runner.invoke(args=['render-posts', '--workers', '0'])
+    assert result.exit_code == 2
+
+
+# A post edited while 'render-posts' runs keeps the HTML for its new body.
+def test_render_posts_concurrent_edit(app, monkeypatch):
+    class EditingPool(object):
+        def __init__(self, max_workers=None):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+        def map(self, fn, chunks):
+            results = [fn(chunk) for chunk in chunks]
+            # what blog.update would do between the read and the write.
+            conn = sqlite3.connect(app.config['DATABASE'])
+            conn.execute(
+                "UPDATE post SET body = 'new', body_html = '<p>new</p>'"
+                ' WHERE id = 1'
+            )
+            conn.commit()
+            conn.close()
+            return results
+
+    monkeypatch.setattr('flaskr.render.ProcessPoolExecutor', EditingPool)
+
+    with app.app_context():
+        render_all_posts()
+        post = get_db().execute('SELECT * FROM post WHERE id = 1').fetchone()
+        assert post['body_html'] == '<p>new</p>'